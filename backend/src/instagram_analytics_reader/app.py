@@ -19,21 +19,27 @@ analytics: {
 ```
 
 If the analytics data exists and is less than 12 hours old, the post is skipped
-for efficiency.
+for efficiency. Posts published more than 30 days ago are only refreshed once
+their analytics are older than 7 days.
 """
 
 from __future__ import annotations
 
-import json
 import logging
 import os
+import socket
+import sys
 import time
 from datetime import datetime, timedelta, timezone
 from typing import Any, Dict, List
 
 import boto3
+import orjson
 import requests
+from boto3.dynamodb.conditions import Attr
 from botocore.exceptions import ClientError
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # ---------------------------------------------------------------------------
 # Configuration
@@ -56,27 +62,99 @@ BUSINESSES_TABLE_NAME: str = os.getenv("BUSINESSES_TABLE", "Businesses")
 DDB = boto3.resource("dynamodb")
 BUSINESSES_TABLE = DDB.Table(BUSINESSES_TABLE_NAME)
 
-REQUEST_TIMEOUT = 8  # seconds
+
+class _TunedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter that sets TCP_NODELAY and TCP keep-alive on pooled sockets."""
+
+    SOCKET_OPTIONS = [
+        (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+    ]
+    # Probe idle pooled connections early so they survive between warm
+    # invocations instead of being silently dropped by intermediaries.
+    if hasattr(socket, "TCP_KEEPIDLE"):
+        SOCKET_OPTIONS += [
+            (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 30),
+            (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10),
+            (socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3),
+        ]
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = self.SOCKET_OPTIONS
+        super().init_poolmanager(*args, **kwargs)
+
+
+# Retry throttling and transient server errors with exponential backoff,
+# honouring Retry-After. The final response is returned rather than raised so
+# callers can inspect its status code.
+RETRY_POLICY = Retry(
+    total=2,
+    backoff_factor=0.3,
+    status_forcelist=[429, 500, 502, 503, 504],
+    allowed_methods=["GET"],
+    respect_retry_after_header=True,
+    raise_on_status=False,
+)
+
+# Persistent HTTP session so Graph API calls reuse TCP/TLS connections.
+SESSION = requests.Session()
+SESSION.mount("https://", _TunedHTTPAdapter(max_retries=RETRY_POLICY))
+
+REQUEST_TIMEOUT = (2, 6)  # (connect, read) seconds
 ANALYTICS_TTL = timedelta(hours=12)
 
+# Posts older than MATURE_POST_AGE have near-frozen metrics and are refreshed
+# on the longer MATURE_ANALYTICS_TTL instead.
+MATURE_POST_AGE = timedelta(days=30)
+MATURE_ANALYTICS_TTL = timedelta(days=7)
+
+# Insight metrics requested through ``fields=insights.metric(...)`` expansion.
+EXPANDED_METRICS = "views,shares,reach,saved"
+
+# Refreshed posts of a business are written together, at most this many per
+# UpdateItem so the expression stays well under DynamoDB's 4 KB limit.
+MAX_POSTS_PER_UPDATE = 50
+
 # ---------------------------------------------------------------------------
 # Helper functions
 # ---------------------------------------------------------------------------
 
-def _token_is_expired(expires_at_iso: str | None) -> bool:
-    """Return ``True`` if *expires_at_iso* is missing or already past."""
+if sys.version_info >= (3, 11):
+    # fromisoformat accepts the trailing "Z" natively from 3.11 onwards.
+    _parse_iso = datetime.fromisoformat
+else:
+    def _parse_iso(value: str) -> datetime:
+        """Parse an ISO-8601 string that may carry a *Z* suffix."""
+        return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def _token_is_expired(expires_at_iso: str | None, now: datetime) -> bool:
+    """Return ``True`` if *expires_at_iso* is missing or already past *now*."""
     if not expires_at_iso:
         return True
     try:
-        expiry_dt = datetime.fromisoformat(expires_at_iso.replace("Z", "+00:00"))
-        return datetime.now(timezone.utc) >= expiry_dt
+        expiry_dt = _parse_iso(expires_at_iso)
+        return now >= expiry_dt
     except ValueError:
         return True
 
 
-def _iso_now() -> str:  # noqa: D401  (simple helper)
-    """Return current UTC time as an ISO-8601 string with *Z* suffix."""
-    return datetime.utcnow().replace(tzinfo=timezone.utc).isoformat().replace("+00:00", "Z")
+def _engagement_of(analytics: Dict[str, Any] | None) -> int:
+    """Return the engagement contribution (likes + comments + views) of a post."""
+    if not analytics:
+        return 0
+    return (
+        analytics.get("likeCount", 0)
+        + analytics.get("commentCount", 0)
+        + analytics.get("viewCount", 0)
+    )
+
+
+def _metrics_unchanged(old: Dict[str, Any] | None, new: Dict[str, Any]) -> bool:
+    """Return True if every metric except ``fetchedAt`` matches the stored analytics."""
+    if not old:
+        return False
+    return all(old.get(key) == value for key, value in new.items() if key != "fetchedAt")
 
 
 class AnalyticsUpdater:  # pylint: disable=too-few-public-methods
@@ -86,6 +164,7 @@ class AnalyticsUpdater:  # pylint: disable=too-few-public-methods
         self.businesses_processed = 0
         self.posts_updated = 0
         self.errors: List[str] = []
+        self._snapshot_clock()
 
     # ----------------------------- Public API -----------------------------
 
@@ -93,9 +172,21 @@ class AnalyticsUpdater:  # pylint: disable=too-few-public-methods
         """Execute the refresh pass over all businesses."""
 
         LOGGER.info("[IG_ANALYTICS] Starting scan of Businesses table %s", BUSINESSES_TABLE_NAME)
+        self._snapshot_clock()
 
+        # Only transfer the attributes we actually use and let DynamoDB drop
+        # businesses without a connected Instagram account server-side.
         scan_kwargs = {
-            "ProjectionExpression": "businessID, publishedPosts, socialMedia",
+            "ProjectionExpression": (
+                "businessID, publishedPosts, #sm.#ig.#conn, #sm.#ig.#td"
+            ),
+            "ExpressionAttributeNames": {
+                "#sm": "socialMedia",
+                "#ig": "instagram",
+                "#conn": "connected",
+                "#td": "tokenDetails",
+            },
+            "FilterExpression": Attr("socialMedia.instagram.connected").eq(True),
         }
         start_key: Dict[str, Any] | None = None
 
@@ -121,11 +212,23 @@ class AnalyticsUpdater:  # pylint: disable=too-few-public-methods
             "postsUpdated": self.posts_updated,
             "errors": len(self.errors),
         }
-        LOGGER.info("[IG_ANALYTICS] Completed run – %s", json.dumps(summary))
+        LOGGER.info("[IG_ANALYTICS] Completed run – %s", orjson.dumps(summary).decode())
         return summary
 
     # --------------------------- Internal helpers -------------------------
 
+    def _snapshot_clock(self) -> None:
+        """Capture the current UTC time once so every post in a run shares it."""
+        self._now = datetime.now(timezone.utc)
+        self._now_iso = self._now.strftime("%Y-%m-%dT%H:%M:%SZ")
+        self._cutoff_iso = (self._now - ANALYTICS_TTL).strftime("%Y-%m-%dT%H:%M:%S")
+        self._mature_cutoff_iso = (self._now - MATURE_ANALYTICS_TTL).strftime("%Y-%m-%dT%H:%M:%S")
+        self._mature_published_iso = (self._now - MATURE_POST_AGE).strftime("%Y-%m-%dT%H:%M:%S")
+
+    def _iso_now(self) -> str:
+        """Return the run's UTC timestamp as an ISO-8601 string with *Z* suffix."""
+        return self._now_iso
+
     def _process_business(self, biz: Dict[str, Any]):
         business_id: str = biz["businessID"]
         insta_info = (
@@ -140,7 +243,7 @@ class AnalyticsUpdater:  # pylint: disable=too-few-public-methods
         access_token: str | None = token_details.get("longLivedToken")
         expires_at: str | None = token_details.get("longLivedExpiresAt")
 
-        if not access_token or _token_is_expired(expires_at):
+        if not access_token or _token_is_expired(expires_at, self._now):
             LOGGER.warning("[IG_ANALYTICS] Token missing/expired for business %s", business_id)
             return
 
@@ -148,7 +251,16 @@ class AnalyticsUpdater:  # pylint: disable=too-few-public-methods
         if not posts:
             return
 
-        updated = False
+        # Running engagement total across all posts – adjusted incrementally as
+        # individual posts are refreshed instead of re-summing every iteration.
+        running_total = 0
+        for p in posts:
+            running_total += _engagement_of(p.get("analytics"))
+
+        # Fetch first, then write every refreshed post of the business in as
+        # few UpdateItems as possible: changed metrics replace the analytics
+        # object, unchanged ones only move fetchedAt so the TTL keeps working.
+        refreshed: List[tuple[int, Dict[str, Any], bool]] = []
         for idx, post in enumerate(posts):
             if self._needs_refresh(post):
                 LOGGER.debug("[IG_ANALYTICS] Fetching metrics for post %s (idx=%d)", post["postID"], idx)
@@ -160,83 +272,88 @@ class AnalyticsUpdater:  # pylint: disable=too-few-public-methods
                     LOGGER.warning("[IG_ANALYTICS] %s", msg)
                     continue
                 if analytics:
+                    refreshed.append((idx, analytics, not _metrics_unchanged(post.get("analytics"), analytics)))
+
+        updated = False
+        for start in range(0, len(refreshed), MAX_POSTS_PER_UPDATE):
+            chunk = refreshed[start:start + MAX_POSTS_PER_UPDATE]
+            clauses: List[str] = []
+            values: Dict[str, Any] = {}
+            new_total = running_total
+            for idx, analytics, changed in chunk:
+                if changed:
+                    new_total += _engagement_of(analytics) - _engagement_of(posts[idx].get("analytics"))
+                    clauses.append(f"publishedPosts[{idx}].analytics = :a{idx}")
+                    values[f":a{idx}"] = analytics
+                else:
+                    clauses.append(f"publishedPosts[{idx}].analytics.fetchedAt = :f")
+                    values[":f"] = analytics["fetchedAt"]
+            changed_count = sum(1 for _, _, changed in chunk if changed)
+            if changed_count:
+                clauses.append("totalEngagement = :e")
+                values[":e"] = new_total
+
+            try:
+                BUSINESSES_TABLE.update_item(
+                    Key={"businessID": business_id},
+                    UpdateExpression="SET " + ", ".join(clauses),
+                    ExpressionAttributeValues=values,
+                )
+            except ClientError as ddb_exc:
+                msg = f"DDB update failed {business_id}:{[idx for idx, _, _ in chunk]} {ddb_exc}"
+                self.errors.append(msg)
+                LOGGER.error("[IG_ANALYTICS] %s", msg)
+                continue
+
+            running_total = new_total
+            for idx, analytics, changed in chunk:
+                if changed:
                     posts[idx]["analytics"] = analytics
-                    # compute engagement across posts (including new analytics)
-                    total_engagement = sum(
-                        (p.get("analytics", {}).get("likeCount", 0)
-                         + p.get("analytics", {}).get("commentCount", 0)
-                         + p.get("analytics", {}).get("viewCount", 0))
-                        for p in posts
-                    )
-
-                    # Write only this index
-                    try:
-                        BUSINESSES_TABLE.update_item(
-                            Key={"businessID": business_id},
-                            UpdateExpression=(
-                                f"SET publishedPosts[{idx}].analytics = :a, totalEngagement = :e"
-                            ),
-                            ExpressionAttributeValues={":a": analytics, ":e": total_engagement},
-                        )
-                        updated = True
-                        self.posts_updated += 1
-                        LOGGER.debug("[IG_ANALYTICS] UpdateItem for %s idx=%d analytics=%s", business_id, idx, json.dumps(analytics)[:300])
-                    except ClientError as ddb_exc:
-                        msg = f"DDB update failed {business_id}:{idx} {ddb_exc}"
-                        self.errors.append(msg)
-                        LOGGER.error("[IG_ANALYTICS] %s", msg)
+                else:
+                    posts[idx]["analytics"]["fetchedAt"] = analytics["fetchedAt"]
+            if changed_count:
+                updated = True
+                self.posts_updated += changed_count
+            LOGGER.debug(
+                "[IG_ANALYTICS] UpdateItem for %s: %d changed, %d unchanged",
+                business_id, changed_count, len(chunk) - changed_count,
+            )
 
         if updated:
             self.businesses_processed += 1
 
-    @staticmethod
-    # def _needs_refresh(post: Dict[str, Any]) -> bool:
-    #     """Determine if the `analytics` key is absent or stale."""
-    #     analytics = post.get("analytics")
-    #     if not analytics:
-    #         return True
-    #     try:
-    #         fetched_at = datetime.fromisoformat(analytics["fetchedAt"].replace("Z", "+00:00"))
-    #         return datetime.now(timezone.utc) - fetched_at > ANALYTICS_TTL
-    #     except Exception:  # noqa: BLE001
-    #         return True
-    def _needs_refresh(post: Dict[str, Any]) -> bool:  # noqa: D401
-        """Always return True to force analytics refresh on every run."""
-        return True
-
-    # ------------------------- HTTP helper -------------------------
-
-    @staticmethod
-    def _request_with_retry(url: str, params: Dict[str, Any]):
-        """GET request with one retry on non-200 or exception."""
-        for attempt in (0, 1):
-            LOGGER.debug("[IG_ANALYTICS] HTTP GET %s params=%s attempt=%d", url, params, attempt)
-            try:
-                resp = requests.get(url, params=params, timeout=REQUEST_TIMEOUT)
-                LOGGER.debug("[IG_ANALYTICS] Response %s %s", resp.status_code, resp.text[:300])
-                if resp.status_code == 200:
-                    return resp
-                if attempt == 0:
-                    time.sleep(1)
-            except Exception:  # noqa: BLE001
-                if attempt == 0:
-                    time.sleep(1)
-        raise RuntimeError(f"request failed url={url} params={params}")
+    def _needs_refresh(self, post: Dict[str, Any]) -> bool:
+        """Determine if the `analytics` key is absent or stale.
+
+        ``fetchedAt`` and ``timestamp`` are stored as UTC ISO-8601 strings,
+        which sort lexicographically, so they are compared directly against
+        the cutoffs instead of being parsed into datetimes. Posts published
+        more than ``MATURE_POST_AGE`` ago use the longer
+        ``MATURE_ANALYTICS_TTL`` since their metrics barely change.
+        """
+        fetched_at = (post.get("analytics") or {}).get("fetchedAt")
+        if not fetched_at:
+            return True
+        published_at = post.get("timestamp")
+        if published_at and published_at < self._mature_published_iso:
+            return fetched_at < self._mature_cutoff_iso
+        return fetched_at < self._cutoff_iso
 
     # -------------------- Instagram API interaction --------------------
 
-    def _fetch_post_metrics(self, media_id: str, token: str) -> Dict[str, Any]:
-        """Return a metrics dict or *None* on failure."""
+    def _fetch_post_metrics_legacy(self, media_id: str, token: str):
+        """Fetch basic fields and insights with two separate requests."""
         basic_url = f"{IG_BASE_URL}/{media_id}"
 
-        # 1. Basic request with media_type
-        basic_resp = self._request_with_retry(
+        # 1. Basic request with media_type (transient failures retried by the adapter)
+        basic_resp = SESSION.get(
             basic_url,
             params={"access_token": token, "fields": "media_type,like_count,comments_count"},
+            timeout=REQUEST_TIMEOUT,
         )
-        basic_data = basic_resp.json()
-
-        media_type = basic_data.get("media_type", "IMAGE")
+        if basic_resp.status_code != 200:
+            raise RuntimeError(f"request failed url={basic_url} status={basic_resp.status_code}")
+        basic_data = orjson.loads(basic_resp.content)
 
         # 2. Try full metric list once to validate capability
         metrics = "likes,comments,views,shares,reach,saved"
@@ -244,22 +361,54 @@ class AnalyticsUpdater:  # pylint: disable=too-few-public-methods
         insight_map: Dict[str, int] = {}
         try:
             insights_url = f"{FB_BASE_URL}/{media_id}/insights"
-            resp = requests.get(
+            resp = SESSION.get(
                 insights_url,
                 params={"access_token": token, "metric": metrics},
                 timeout=REQUEST_TIMEOUT,
             )
             LOGGER.info(
-                "[IG_ANALYTICS] insights call %s status=%s body=%s", insights_url, resp.status_code, resp.text[:200]
+                "[IG_ANALYTICS] insights call %s status=%s bytes=%d", insights_url, resp.status_code, len(resp.content)
             )
             if resp.status_code == 200:
-                insight_items = resp.json().get("data", [])
+                insight_items = orjson.loads(resp.content).get("data", [])
                 insight_map = {d["name"]: d["values"][0]["value"] for d in insight_items}
             else:
                 LOGGER.warning("[IG_ANALYTICS] insights rejected for %s: %s", media_id, resp.text)
         except Exception as insight_exc:  # noqa: BLE001
             LOGGER.warning("[IG_ANALYTICS] insights call failed for %s: %s", media_id, insight_exc)
 
+        return basic_data, insight_map
+
+    def _fetch_post_metrics(self, media_id: str, token: str) -> Dict[str, Any]:
+        """Return a metrics dict or *None* on failure."""
+        # Basic fields and insights in a single field-expansion request
+        resp = SESSION.get(
+            f"{IG_BASE_URL}/{media_id}",
+            params={
+                "access_token": token,
+                "fields": f"media_type,like_count,comments_count,insights.metric({EXPANDED_METRICS})",
+            },
+            timeout=REQUEST_TIMEOUT,
+        )
+        if resp.status_code == 200:
+            basic_data = orjson.loads(resp.content)
+            insight_items = basic_data.get("insights", {}).get("data", [])
+            insight_map = {d["name"]: d["values"][0]["value"] for d in insight_items}
+        elif resp.status_code != 400:
+            # Throttling, server and auth errors would fail the legacy calls too
+            raise RuntimeError(f"request failed url={IG_BASE_URL}/{media_id} status={resp.status_code}")
+        else:
+            # Some media types reject individual metrics – fall back to the
+            # separate basic + insights requests.
+            LOGGER.info(
+                "[IG_ANALYTICS] expanded fetch rejected for %s status=%s – using legacy calls",
+                media_id,
+                resp.status_code,
+            )
+            basic_data, insight_map = self._fetch_post_metrics_legacy(media_id, token)
+
+        media_type = basic_data.get("media_type", "IMAGE")
+
         # Build analytics object
         like_count = basic_data.get("like_count", 0)
         comment_count = basic_data.get("comments_count", 0)
@@ -269,7 +418,7 @@ class AnalyticsUpdater:  # pylint: disable=too-few-public-methods
         engagement = like_count + comment_count + view_count + share_count
 
         analytics = {
-            "fetchedAt": _iso_now(),
+            "fetchedAt": self._iso_now(),
             "likeCount": like_count,
             "commentCount": comment_count,
             "viewCount": view_count,
@@ -291,5 +440,6 @@ def lambda_handler(event: Dict[str, Any], context):  # noqa: D401
     updater = AnalyticsUpdater()
     summary = updater.run()
     summary["elapsedSeconds"] = round(time.time() - start, 2)
-    LOGGER.info("[IG_ANALYTICS] Lambda complete %s", json.dumps(summary))
-    return {"statusCode": 200, "body": json.dumps(summary)}
+    body = orjson.dumps(summary).decode()
+    LOGGER.info("[IG_ANALYTICS] Lambda complete %s", body)
+    return {"statusCode": 200, "body": body}
@@ -1,9 +1,139 @@
-import json
 import boto3
+import orjson
+from boto3.dynamodb.conditions import Key
+from botocore.config import Config
+from botocore.exceptions import ClientError
 import requests
-import uuid
-from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
 import os
+import time
+import logging
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOGGER = logging.getLogger()
+LOGGER.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+
+# Configuration and HTTP session initialised once per container
+CLIENT_ID = os.environ.get('INSTAGRAM_CLIENT_ID')
+CLIENT_SECRET = os.environ.get('INSTAGRAM_CLIENT_SECRET')
+TOKEN_URL = os.environ.get('INSTAGRAM_TOKEN_URL', 'https://api.instagram.com/oauth/access_token')
+DYNAMODB_TABLE = os.environ.get('DYNAMODB_TABLE', 'Businesses')
+GRAPH_URL = os.environ.get('INSTAGRAM_GRAPH_URL', 'https://graph.instagram.com')
+CREDENTIALS_CONFIGURED = bool(CLIENT_ID and CLIENT_SECRET and DYNAMODB_TABLE)
+
+# Stored timestamps are second-precision UTC ISO-8601 strings
+ISO_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+SHORT_LIVED_TTL = 3600  # seconds
+
+BOTO_CONFIG = Config(
+    region_name=os.environ.get('AWS_REGION'),
+    retries={'mode': 'adaptive', 'max_attempts': 2},
+    tcp_keepalive=True,
+    max_pool_connections=10
+)
+DYNAMODB = boto3.resource('dynamodb', config=BOTO_CONFIG)
+TABLE = DYNAMODB.Table(DYNAMODB_TABLE)
+
+SESSION = requests.Session()
+# Transient Graph API failures are retried on idempotent GETs only; the
+# authorization code POST is single-use and never retried.
+SESSION.mount('https://', HTTPAdapter(
+    pool_connections=4,
+    pool_maxsize=10,
+    max_retries=Retry(total=2, backoff_factor=0.2, status_forcelist=[429, 500, 502, 503, 504], raise_on_status=False)
+))
+
+REQUEST_TIMEOUT = (2, 6)  # (connect, read) seconds
+
+# The code exchange body is form-encoded up front and sent as raw bytes
+FORM_HEADERS = {'Content-Type': 'application/x-www-form-urlencoded'}
+
+# Static CORS headers shared by every response
+CORS_HEADERS = {
+    'Access-Control-Allow-Origin': '*',
+    'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
+    'Access-Control-Allow-Methods': 'POST,OPTIONS'
+}
+CORS_JSON_HEADERS = {**CORS_HEADERS, 'Content-Type': 'application/json'}
+
+# Required request body fields and the pre-built 400 response for each
+REQUIRED_FIELDS = (
+    ('userId', 'userId is required.'),
+    ('code', 'authorization code is required.'),
+    ('redirectUri', 'redirectUri is required.'),
+)
+MISSING_FIELD_RESPONSES = {
+    field: {
+        'statusCode': 400,
+        'headers': CORS_JSON_HEADERS,
+        'body': orjson.dumps({'success': False, 'message': message}).decode()
+    }
+    for field, message in REQUIRED_FIELDS
+}
+
+# Worker threads for concurrent Graph API calls within an invocation
+EXECUTOR = ThreadPoolExecutor(max_workers=2)
+
+def iso_utc(epoch_seconds):
+    """Format a Unix timestamp as a UTC ISO-8601 string."""
+    return time.strftime(ISO_FORMAT, time.gmtime(epoch_seconds))
+
+def store_instagram_connection(business_id, instagram_fields):
+    """
+    Write Instagram connection fields into a business' socialMedia.instagram map.
+    
+    Only the given fields are written, in a single UpdateItem, when
+    socialMedia.instagram already exists. On first connect the missing
+    parent maps are created instead.
+    
+    Args:
+        business_id: Key of the business record to update
+        instagram_fields: Mapping of fields to set under socialMedia.instagram
+    """
+    key = {'businessID': business_id}
+    names = {'#sm': 'socialMedia', '#ig': 'instagram'}
+    values = {}
+    assignments = []
+    for i, (field, value) in enumerate(instagram_fields.items()):
+        names[f'#f{i}'] = field
+        values[f':v{i}'] = value
+        assignments.append(f'#sm.#ig.#f{i} = :v{i}')
+    
+    try:
+        TABLE.update_item(
+            Key=key,
+            UpdateExpression='SET ' + ', '.join(assignments),
+            ConditionExpression='attribute_exists(#sm.#ig)',
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values
+        )
+        return
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+    
+    # First connection: socialMedia.instagram does not exist yet
+    try:
+        TABLE.update_item(
+            Key=key,
+            UpdateExpression='SET #sm.#ig = :ig',
+            ConditionExpression='attribute_exists(#sm)',
+            ExpressionAttributeNames={'#sm': 'socialMedia', '#ig': 'instagram'},
+            ExpressionAttributeValues={':ig': instagram_fields}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        TABLE.update_item(
+            Key=key,
+            UpdateExpression='SET #sm = :sm',
+            ConditionExpression='attribute_exists(businessID)',
+            ExpressionAttributeNames={'#sm': 'socialMedia'},
+            ExpressionAttributeValues={':sm': {'instagram': instagram_fields}}
+        )
 
 def lambda_handler(event, context):
     """
@@ -23,103 +153,126 @@ def lambda_handler(event, context):
     Returns:
         dict: Response with success status and message
     """
-    print("Received event:", json.dumps(event))
+    LOGGER.debug("[IG_OAUTH] Received event %r", event)
     
-    # Define CORS headers
-    cors_headers = {
-        'Access-Control-Allow-Origin': '*',
-        'Access-Control-Allow-Headers': 'Content-Type,X-Amz-Date,Authorization,X-Api-Key,X-Amz-Security-Token',
-        'Access-Control-Allow-Methods': 'POST,OPTIONS'
-    }
-
     # Handle OPTIONS request for CORS preflight
     if event.get('httpMethod') == 'OPTIONS':
-        print("Handling OPTIONS request")
+        LOGGER.debug("[IG_OAUTH] Handling OPTIONS request")
         return {
             'statusCode': 200,
-            'headers': cors_headers,
+            'headers': CORS_HEADERS,
             'body': ''
         }
+    
+    # Steps record their outcome here and a single summary line is logged
+    trace = {'requestId': event.get('requestContext', {}).get('requestId')}
+    response = exchange_authorization_code(event, trace)
+    trace['statusCode'] = response['statusCode']
+    if LOGGER.isEnabledFor(logging.INFO):
+        LOGGER.info("[IG_OAUTH] %s", orjson.dumps(trace).decode())
+    return response
 
+def exchange_authorization_code(event, trace):
+    """
+    Run the code exchange for a non-preflight request and build its response.
+    
+    Args:
+        event: Lambda event containing the authorization code and user info
+        trace: Dict collecting per-step outcomes for the summary log line
+        
+    Returns:
+        dict: API Gateway response
+    """
     try:
-        print("Processing request body:", event.get('body'))
-        data = json.loads(event['body'])
+        trace['bodyLen'] = len(event.get('body') or '')
+        data = orjson.loads(event['body'])
         
         # Validate required fields
-        user_id = data.get('userId')
-        auth_code = data.get('code')
-        redirect_uri = data.get('redirectUri')
+        for field, _ in REQUIRED_FIELDS:
+            if not data.get(field):
+                return MISSING_FIELD_RESPONSES[field]
         
-        print(f"Received data - userId: {user_id}, code: {auth_code}, redirectUri: {redirect_uri}")
+        user_id = data['userId']
+        auth_code = data['code']
+        redirect_uri = data['redirectUri']
+        trace['userId'] = user_id
         
-        if not user_id:
-            return {
-                'statusCode': 400,
-                'headers': {**cors_headers, 'Content-Type': 'application/json'},
-                'body': json.dumps({'success': False, 'message': 'userId is required.'})
-            }
+        LOGGER.debug("[IG_OAUTH] Received data - userId: %s, code: %s, redirectUri: %s", user_id, auth_code, redirect_uri)
         
-        if not auth_code:
-            return {
-                'statusCode': 400,
-                'headers': {**cors_headers, 'Content-Type': 'application/json'},
-                'body': json.dumps({'success': False, 'message': 'authorization code is required.'})
-            }
+        LOGGER.debug("[IG_OAUTH] Using token URL: %s", TOKEN_URL)
         
-        if not redirect_uri:
+        if not CREDENTIALS_CONFIGURED:
+            LOGGER.error("[IG_OAUTH] Missing Instagram credentials or DynamoDB table")
             return {
-                'statusCode': 400,
-                'headers': {**cors_headers, 'Content-Type': 'application/json'},
-                'body': json.dumps({'success': False, 'message': 'redirectUri is required.'})
+                'statusCode': 500,
+                'headers': CORS_JSON_HEADERS,
+                'body': orjson.dumps({'success': False, 'message': 'Instagram credentials not configured.'}).decode()
             }
         
-        # Get Instagram credentials from environment variables
-        client_id = os.environ.get('INSTAGRAM_CLIENT_ID')
-        client_secret = os.environ.get('INSTAGRAM_CLIENT_SECRET')
-        token_url = os.environ.get('INSTAGRAM_TOKEN_URL', 'https://api.instagram.com/oauth/access_token')
-        dynamodb_table = 'Businesses'
-        
-        print(f"Using token URL: {token_url}")
-        
-        if not all([client_id, client_secret, dynamodb_table]):
-            print("Missing Instagram credentials or DynamoDB table")
+        # Find business record by userId
+        try:
+            # Query the userId GSI for the business owned by this user
+            response = TABLE.query(
+                IndexName='userId-index',
+                KeyConditionExpression=Key('userId').eq(user_id),
+                Limit=1,
+                ProjectionExpression='businessID'
+            )
+            
+            if not response.get('Items'):
+                return {
+                    'statusCode': 404,
+                    'headers': CORS_JSON_HEADERS,
+                    'body': orjson.dumps({'success': False, 'message': 'No business found for this user.'}).decode()
+                }
+            
+            business_item = response['Items'][0]
+            business_id = business_item['businessID']
+            
+            trace['businessId'] = business_id
+            
+        except Exception as e:
+            LOGGER.error("[IG_OAUTH] Error finding business record: %s", e)
             return {
                 'statusCode': 500,
-                'headers': {**cors_headers, 'Content-Type': 'application/json'},
-                'body': json.dumps({'success': False, 'message': 'Instagram credentials not configured.'})
+                'headers': CORS_JSON_HEADERS,
+                'body': orjson.dumps({'success': False, 'message': 'Failed to find business record.'}).decode()
             }
         
         # Exchange authorization code for access token
         token_data = {
-            'client_id': client_id,
-            'client_secret': client_secret,
+            'client_id': CLIENT_ID,
+            'client_secret': CLIENT_SECRET,
             'grant_type': 'authorization_code',
             'redirect_uri': redirect_uri,
             'code': auth_code
         }
         
-        print(f"Exchanging code for token for user: {user_id}")
-        print(f"Token request data: {json.dumps({**token_data, 'client_secret': '***'})}")
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            LOGGER.debug("[IG_OAUTH] Token request data: %r", {**token_data, 'client_secret': '***'})
         
-        token_response = requests.post(token_url, data=token_data)
+        token_response = SESSION.post(
+            TOKEN_URL,
+            data=urlencode(token_data).encode(),
+            headers=FORM_HEADERS,
+            timeout=REQUEST_TIMEOUT
+        )
         
-        print(f"Token response status: {token_response.status_code}")
-        print(f"Token response body: {token_response.text}")
+        trace['tokenStatus'] = token_response.status_code
         
         if not token_response.ok:
             error_details = token_response.text
-            print(f"Token exchange failed: {error_details}")
+            LOGGER.error("[IG_OAUTH] Token exchange failed: %s", error_details)
             return {
                 'statusCode': 400,
-                'headers': {**cors_headers, 'Content-Type': 'application/json'},
-                'body': json.dumps({
+                'headers': CORS_JSON_HEADERS,
+                'body': orjson.dumps({
                     'success': False,
                     'message': 'Failed to exchange authorization code for token.'
-                })
+                }).decode()
             }
         
-        token_info = token_response.json()
-        print(f"Token info: {json.dumps({**token_info, 'access_token': '***'})}")
+        token_info = orjson.loads(token_response.content)
         
         # Extract token information
         access_token = token_info.get('access_token')
@@ -128,103 +281,81 @@ def lambda_handler(event, context):
         if not access_token:
             return {
                 'statusCode': 400,
-                'headers': {**cors_headers, 'Content-Type': 'application/json'},
-                'body': json.dumps({'success': False, 'message': 'No access token received from Instagram.'})
+                'headers': CORS_JSON_HEADERS,
+                'body': orjson.dumps({'success': False, 'message': 'No access token received from Instagram.'}).decode()
             }
         
+        # One clock read for every timestamp stored by this invocation
+        now = time.time()
+        
+        # The long-lived exchange and the username lookup both only need the
+        # short-lived token, so issue them concurrently.
+        long_lived_params = {
+            'grant_type': 'ig_exchange_token',
+            'client_secret': CLIENT_SECRET,
+            'access_token': access_token
+        }
+        LOGGER.debug("[IG_OAUTH] Exchanging short-lived token for long-lived token")
+        long_lived_future = EXECUTOR.submit(
+            SESSION.get,
+            f'{GRAPH_URL}/access_token',
+            params=long_lived_params,
+            timeout=REQUEST_TIMEOUT
+        )
+        user_info_future = EXECUTOR.submit(
+            SESSION.get,
+            f'{GRAPH_URL}/me',
+            params={'access_token': access_token, 'fields': 'username'},
+            timeout=REQUEST_TIMEOUT
+        )
+        
         # Exchange short-lived token for long-lived token
         long_lived_token = None
         long_lived_expires_at = None
         warning_message = None
         
         try:
-            long_lived_params = {
-                'grant_type': 'ig_exchange_token',
-                'client_secret': client_secret,
-                'access_token': access_token
-            }
-            
-            print("Exchanging short-lived token for long-lived token")
-            long_lived_response = requests.get('https://graph.instagram.com/access_token', params=long_lived_params)
+            long_lived_response = long_lived_future.result()
             
-            print(f"Long-lived token response status: {long_lived_response.status_code}")
-            print(f"Long-lived token response: {long_lived_response.text}")
+            trace['longLivedStatus'] = long_lived_response.status_code
             
             if long_lived_response.ok:
-                long_lived_info = long_lived_response.json()
+                long_lived_info = orjson.loads(long_lived_response.content)
                 long_lived_token = long_lived_info.get('access_token')
                 expires_in = long_lived_info.get('expires_in', 5184000)  # Default 60 days
                 
                 # Calculate expiration timestamp (60 days from now)
-                long_lived_expires_at = (datetime.utcnow() + timedelta(seconds=expires_in)).isoformat() + 'Z'
-                print(f"Long-lived token acquired, expires at: {long_lived_expires_at}")
+                long_lived_expires_at = iso_utc(now + expires_in)
             else:
-                print(f"Long-lived token exchange failed: {long_lived_response.text}")
+                LOGGER.warning("[IG_OAUTH] Long-lived token exchange failed: %s", long_lived_response.text)
                 warning_message = "Instagram connected with short-lived token. Long-lived token exchange failed."
                 # Set short-lived token expiration (1 hour)
-                long_lived_expires_at = (datetime.utcnow() + timedelta(hours=1)).isoformat() + 'Z'
+                long_lived_expires_at = iso_utc(now + SHORT_LIVED_TTL)
                 
         except Exception as e:
-            print(f"Long-lived token exchange error: {str(e)}")
+            LOGGER.warning("[IG_OAUTH] Long-lived token exchange error: %s", e)
             warning_message = "Instagram connected with short-lived token. Long-lived token exchange failed."
-            long_lived_expires_at = (datetime.utcnow() + timedelta(hours=1)).isoformat() + 'Z'
+            long_lived_expires_at = iso_utc(now + SHORT_LIVED_TTL)
         
         # Get Instagram username
         username = None
         try:
-            # Use long-lived token if available, otherwise short-lived
-            token_for_user_info = long_lived_token if long_lived_token else access_token
-            user_info_response = requests.get(
-                'https://graph.instagram.com/me',
-                params={'access_token': token_for_user_info, 'fields': 'username'}
-            )
+            user_info_response = user_info_future.result()
             
             if user_info_response.ok:
-                user_info = user_info_response.json()
+                user_info = orjson.loads(user_info_response.content)
                 username = user_info.get('username', f'user_{instagram_user_id}')
-                print(f"Retrieved username: {username}")
+                LOGGER.debug("[IG_OAUTH] Retrieved username: %s", username)
             else:
-                print(f"Failed to get username: {user_info_response.text}")
+                LOGGER.warning("[IG_OAUTH] Failed to get username: %s", user_info_response.text)
                 username = f'user_{instagram_user_id}' if instagram_user_id else 'instagram_user'
                 
         except Exception as e:
-            print(f"Username retrieval error: {str(e)}")
+            LOGGER.warning("[IG_OAUTH] Username retrieval error: %s", e)
             username = f'user_{instagram_user_id}' if instagram_user_id else 'instagram_user'
         
-        # Initialize DynamoDB
-        dynamodb = boto3.resource('dynamodb')
-        table = dynamodb.Table(dynamodb_table)
-        
-        # Find business record by userId
-        try:
-            # Scan for business with matching userId
-            response = table.scan(
-                FilterExpression='userId = :user_id',
-                ExpressionAttributeValues={':user_id': user_id}
-            )
-            
-            if not response.get('Items'):
-                return {
-                    'statusCode': 404,
-                    'headers': {**cors_headers, 'Content-Type': 'application/json'},
-                    'body': json.dumps({'success': False, 'message': 'No business found for this user.'})
-                }
-            
-            business_item = response['Items'][0]
-            business_id = business_item['businessID']
-            
-            print(f"Found business record: {business_id}")
-            
-        except Exception as e:
-            print(f"Error finding business record: {str(e)}")
-            return {
-                'statusCode': 500,
-                'headers': {**cors_headers, 'Content-Type': 'application/json'},
-                'body': json.dumps({'success': False, 'message': 'Failed to find business record.'})
-            }
-        
         # Prepare token details
-        current_time = datetime.utcnow().isoformat() + 'Z'
+        current_time = iso_utc(now)
         token_details = {
             'shortLivedToken': access_token,
             'longLivedToken': long_lived_token if long_lived_token else access_token,
@@ -236,66 +367,53 @@ def lambda_handler(event, context):
         
         # Update business record with token information
         try:
-            # Get the existing business item
-            business_response = table.get_item(Key={'businessID': business_id})
-            business_item = business_response['Item']
-            
-            # Update Instagram fields
-            if 'socialMedia' not in business_item:
-                business_item['socialMedia'] = {}
-            if 'instagram' not in business_item['socialMedia']:
-                business_item['socialMedia']['instagram'] = {}
-                
-            business_item['socialMedia']['instagram'].update({
+            store_instagram_connection(business_id, {
                 'connected': True,
                 'lastConnected': current_time,
                 'username': username,
                 'tokenDetails': token_details
             })
             
-            # Save the updated business item
-            table.put_item(Item=business_item)
-            
-            print(f"Successfully updated business record {business_id} with token information")
+            trace['longLivedExpiresAt'] = long_lived_expires_at
             
             # Return success response
             success_message = warning_message if warning_message else "Instagram account connected successfully"
             
             return {
                 'statusCode': 200,
-                'headers': {**cors_headers, 'Content-Type': 'application/json'},
-                'body': json.dumps({
+                'headers': CORS_JSON_HEADERS,
+                'body': orjson.dumps({
                     'success': True,
                     'message': success_message
-                })
+                }).decode()
             }
             
         except Exception as e:
-            print(f"Error updating business record: {str(e)}")
+            LOGGER.error("[IG_OAUTH] Error updating business record: %s", e)
             return {
                 'statusCode': 500,
-                'headers': {**cors_headers, 'Content-Type': 'application/json'},
-                'body': json.dumps({'success': False, 'message': 'Failed to store token information.'})
+                'headers': CORS_JSON_HEADERS,
+                'body': orjson.dumps({'success': False, 'message': 'Failed to store token information.'}).decode()
             }
         
-    except json.JSONDecodeError as e:
-        print(f"JSON decode error: {str(e)}")
+    except orjson.JSONDecodeError as e:
+        LOGGER.warning("[IG_OAUTH] JSON decode error: %s", e)
         return {
             'statusCode': 400,
-            'headers': {**cors_headers, 'Content-Type': 'application/json'},
-            'body': json.dumps({'success': False, 'message': 'Invalid JSON in request body.'})
+            'headers': CORS_JSON_HEADERS,
+            'body': orjson.dumps({'success': False, 'message': 'Invalid JSON in request body.'}).decode()
         }
     except requests.exceptions.RequestException as e:
-        print(f"Request error during token exchange: {str(e)}")
+        LOGGER.error("[IG_OAUTH] Request error during token exchange: %s", e)
         return {
             'statusCode': 500,
-            'headers': {**cors_headers, 'Content-Type': 'application/json'},
-            'body': json.dumps({'success': False, 'message': 'Network error during token exchange.'})
+            'headers': CORS_JSON_HEADERS,
+            'body': orjson.dumps({'success': False, 'message': 'Network error during token exchange.'}).decode()
         }
     except Exception as e:
-        print(f"Unexpected error: {str(e)}")
+        LOGGER.exception("[IG_OAUTH] Unexpected error: %s", e)
         return {
             'statusCode': 500,
-            'headers': {**cors_headers, 'Content-Type': 'application/json'},
-            'body': json.dumps({'success': False, 'message': 'Could not exchange authorization code.'})
+            'headers': CORS_JSON_HEADERS,
+            'body': orjson.dumps({'success': False, 'message': 'Could not exchange authorization code.'}).decode()
         } 
\ No newline at end of file
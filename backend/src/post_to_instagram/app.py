@@ -1,44 +1,215 @@
-import json
+import asyncio
+import os
 import boto3
-import requests
-import time
+import aiohttp
+import orjson
+from botocore.config import Config
+from botocore.exceptions import ClientError
 import logging
+from collections import Counter, defaultdict
+import time
 from datetime import datetime
-from urllib.parse import quote_plus
+
+# DynamoDB connection pool size, matching the SQS batch size
+MAX_POOL_CONNECTIONS = 10
 
 # Initialize clients
-dynamodb = boto3.resource('dynamodb')
-table = dynamodb.Table('Businesses')
+dynamodb = boto3.resource('dynamodb', config=Config(
+    region_name=os.environ.get('AWS_REGION'),
+    retries={'mode': 'adaptive', 'max_attempts': 2},
+    tcp_keepalive=True,
+    max_pool_connections=MAX_POOL_CONNECTIONS
+))
+BUSINESSES_TABLE = 'Businesses'
+table = dynamodb.Table(BUSINESSES_TABLE)
+
+# Business attributes needed to post; read once per batch with BatchGetItem
+BUSINESS_PROJECTION = 'businessID, socialMedia, upcomingPosts'
+BATCH_GET_MAX_KEYS = 100
+BATCH_GET_ATTEMPTS = 4
+
+# Credentials resolved by this container, keyed by business ID:
+# (access_token, instagram_user_id, cache_expires_epoch)
+CREDENTIALS_CACHE: dict[str, tuple[str, str, float]] = {}
+CREDENTIALS_CACHE_TTL = 300  # seconds
 
 # Instagram API constants
 INSTAGRAM_API_BASE = "https://graph.instagram.com/v18.0"
+MEDIA_URL = INSTAGRAM_API_BASE + "/{}/media"
+PUBLISH_URL = INSTAGRAM_API_BASE + "/{}/media_publish"
+NODE_URL = INSTAGRAM_API_BASE + "/{}"
 
 # Logger setup
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
-REQUEST_TIMEOUT = 25 # seconds
+# Graph reads fail fast; container creation (Instagram fetches the image
+# before it answers) and publishing regularly take longer and get their own
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(sock_connect=3, sock_read=6)  # seconds
+CREATE_TIMEOUT = aiohttp.ClientTimeout(sock_connect=3, sock_read=25)  # seconds
+PUBLISH_TIMEOUT = aiohttp.ClientTimeout(sock_connect=3, sock_read=25)  # seconds
+
+# Seconds to wait before each container status check, 22 s in total
+POLL_DELAYS = (1, 1, 2, 2, 3, 5, 8)
+
+# Per-record work is bounded by a deadline taken from the invocation's
+# remaining time, so the batch returns before Lambda times out and SQS
+# redelivers messages that were already published
+SAVE_MARGIN = 5  # seconds kept for the publishedPosts writes
+PUBLISH_BUDGET = PUBLISH_TIMEOUT.sock_connect + PUBLISH_TIMEOUT.sock_read  # seconds for the publish call
+CREATE_BUDGET = CREATE_TIMEOUT.sock_connect + CREATE_TIMEOUT.sock_read + PUBLISH_BUDGET  # seconds for container creation and publish
+
+# Poll outcomes worth another attempt; ERROR and EXPIRED containers are not
+RETRYABLE_POLL_STATUSES = frozenset({'TIMEOUT', 'REQUEST_FAILED'})
+
+# Retry policy for idempotent Graph API reads
+GET_RETRY_ATTEMPTS = 3
+GET_RETRY_BACKOFF = 0.5  # seconds, doubled per attempt
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Event loop and HTTP session are created on first use and kept for warm
+# invocations so pooled connections to graph.instagram.com survive between
+# batches
+_LOOP: asyncio.AbstractEventLoop | None = None
+_HTTP_SESSION: aiohttp.ClientSession | None = None
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """Return the event loop shared across invocations of this container.
+    
+    :return: Open event loop
+    :rtype: asyncio.AbstractEventLoop
+    """
+    global _LOOP
+    if _LOOP is None or _LOOP.is_closed():
+        _LOOP = asyncio.new_event_loop()
+        asyncio.set_event_loop(_LOOP)
+    return _LOOP
+
+async def get_http_session() -> aiohttp.ClientSession:
+    """Return the shared aiohttp session, creating it on first use.
+    
+    :return: Open client session bound to the shared event loop
+    :rtype: aiohttp.ClientSession
+    """
+    global _HTTP_SESSION
+    if _HTTP_SESSION is None or _HTTP_SESSION.closed:
+        connector = aiohttp.TCPConnector(limit=32, limit_per_host=16, ttl_dns_cache=300, keepalive_timeout=60)
+        _HTTP_SESSION = aiohttp.ClientSession(connector=connector, timeout=REQUEST_TIMEOUT)
+    return _HTTP_SESSION
+
+async def graph_get(url: str, params: dict) -> tuple[int, str]:
+    """GET a Graph API resource, retrying throttling and transient failures.
+    
+    Only reads are retried; container creation and publishing are not
+    idempotent and go through the session directly.
+    
+    :param url: Graph API URL
+    :type url: str
+    :param params: Query parameters
+    :type params: dict
+    :return: Tuple of (status_code, response_text)
+    :rtype: tuple[int, str]
+    """
+    session = await get_http_session()
+    for attempt in range(GET_RETRY_ATTEMPTS):
+        last_attempt = attempt == GET_RETRY_ATTEMPTS - 1
+        try:
+            async with session.get(url, params=params) as response:
+                body = await response.text()
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if last_attempt:
+                raise
+        else:
+            if response.status not in RETRY_STATUSES or last_attempt:
+                return response.status, body
+        await asyncio.sleep(GET_RETRY_BACKOFF * (2 ** attempt))
 
-def get_business_instagram_token(business_id: str) -> tuple[str, str] | tuple[None, None]:
+def fetch_businesses(business_ids: set[str]) -> dict[str, dict | None]:
+    """Batch-read the business records referenced by an SQS batch.
+    
+    Keys still unprocessed after ``BATCH_GET_ATTEMPTS`` are left out of the
+    result so callers fall back to a single ``get_item``.
+    
+    :param business_ids: Distinct business IDs to read
+    :type business_ids: set[str]
+    :return: Business record (or None if it does not exist) per business ID
+    :rtype: dict[str, dict | None]
+    """
+    businesses: dict[str, dict | None] = {}
+    keys = [{'businessID': business_id} for business_id in business_ids]
+    
+    for start in range(0, len(keys), BATCH_GET_MAX_KEYS):
+        request = {
+            BUSINESSES_TABLE: {
+                'Keys': keys[start:start + BATCH_GET_MAX_KEYS],
+                'ProjectionExpression': BUSINESS_PROJECTION,
+            }
+        }
+        requested = {key['businessID'] for key in request[BUSINESSES_TABLE]['Keys']}
+        
+        for attempt in range(BATCH_GET_ATTEMPTS):
+            response = dynamodb.batch_get_item(RequestItems=request)
+            for item in response.get('Responses', {}).get(BUSINESSES_TABLE, []):
+                businesses[item['businessID']] = item
+            request = response.get('UnprocessedKeys')
+            if not request:
+                break
+            time.sleep(0.05 * (2 ** attempt))
+        
+        unprocessed = {key['businessID'] for key in request[BUSINESSES_TABLE]['Keys']} if request else set()
+        for business_id in requested - unprocessed:
+            businesses.setdefault(business_id, None)
+    
+    return businesses
+
+def time_left(deadline: float | None) -> float:
+    """Return the seconds left before a ``time.monotonic()`` deadline.
+    
+    :param deadline: Deadline, or None for no limit
+    :type deadline: float | None
+    :return: Seconds left, infinite when there is no deadline
+    :rtype: float
+    """
+    if deadline is None:
+        return float('inf')
+    return deadline - time.monotonic()
+
+def get_business_instagram_token(business_id: str, businesses: dict[str, dict | None] | None = None) -> tuple[str, str] | tuple[None, None]:
     """Retrieve Instagram access token and user ID for a business.
     
     :param business_id: The business ID to lookup
     :type business_id: str
-    :return: Tuple of (access_token, instagram_user_id) or (None, None) if not found
+    :param businesses: Records prefetched by ``fetch_businesses``; the table is
+        only read when ``business_id`` is missing from it
+    :type businesses: dict[str, dict | None] | None
+    :return: Tuple of (access_token, instagram_user_id) or (None, None) if the
+        business has no usable Instagram connection
     :rtype: tuple[str, str] | tuple[None, None]
+    :raises Exception: If the business record could not be read
     """
+    cached = CREDENTIALS_CACHE.get(business_id)
+    if cached and cached[2] > time.time():
+        return cached[0], cached[1]
+    
     try:
-        response = table.get_item(Key={'businessID': business_id})
+        if businesses is not None and business_id in businesses:
+            business_data = businesses[business_id]
+        else:
+            response = table.get_item(
+                Key={'businessID': business_id},
+                ProjectionExpression=BUSINESS_PROJECTION,
+                ConsistentRead=False
+            )
+            business_data = response.get('Item')
         
-        if 'Item' not in response:
-            logger.error(f"ERROR: Business {business_id} not found in database")
+        if business_data is None:
+            logger.error("[POST_IG] Business %s not found in database", business_id)
             return None, None
         
-        business_data = response['Item']
         social_media = business_data.get('socialMedia', {})
         instagram = social_media.get('instagram', {})
         
         if not instagram.get('connected', False):
-            logger.error(f"ERROR: Instagram not connected for business {business_id}")
+            logger.error("[POST_IG] Instagram not connected for business %s", business_id)
             return None, None
         
         token_details = instagram.get('tokenDetails', {})
@@ -46,25 +217,121 @@ def get_business_instagram_token(business_id: str) -> tuple[str, str] | tuple[No
         instagram_user_id = token_details.get('instagramUserId')
         
         if not access_token or not instagram_user_id:
-            logger.error(f"ERROR: Missing Instagram credentials for business {business_id}")
+            logger.error("[POST_IG] Missing Instagram credentials for business %s", business_id)
             return None, None
         
         # Check token expiration
+        now = time.time()
+        cache_expires = now + CREDENTIALS_CACHE_TTL
         expires_at = token_details.get('longLivedExpiresAt')
         if expires_at:
-            expiry_date = datetime.fromisoformat(expires_at.replace('Z', '+00:00'))
-            if datetime.now(expiry_date.tzinfo) >= expiry_date:
-                logger.error(f"ERROR: Instagram token expired for business {business_id}")
+            expires_epoch = datetime.fromisoformat(expires_at.replace('Z', '+00:00')).timestamp()
+            if now >= expires_epoch:
+                logger.error("[POST_IG] Instagram token expired for business %s", business_id)
                 return None, None
+            cache_expires = min(cache_expires, expires_epoch)
         
-        logger.info(f"SUCCESS: Retrieved Instagram credentials for business {business_id}")
+        CREDENTIALS_CACHE[business_id] = (access_token, instagram_user_id, cache_expires)
+        logger.info("[POST_IG] Retrieved Instagram credentials for business %s", business_id)
         return access_token, instagram_user_id
         
     except Exception as e:
-        logger.exception(f"ERROR: Failed to retrieve Instagram token for business {business_id}: {str(e)}")
-        return None, None
+        # A failed read says nothing about the connection; let the caller retry
+        logger.exception("[POST_IG] Failed to retrieve Instagram token for business %s: %s", business_id, e)
+        raise
 
-def create_instagram_media_container(image_url: str, caption: str, access_token: str, ig_user_id: str) -> str | None:
+def record_published_posts(business_id: str, published: list[tuple[dict, str | None]], businesses: dict[str, dict | None] | None = None) -> list[int]:
+    """Append posts to publishedPosts and drop their upcomingPosts entries.
+    
+    All changes for the business go out in a single UpdateItem, guarded on
+    each upcomingPosts entry still sitting at the index it was found at. If
+    the list moved since it was read, the indexes are looked up once more
+    from a fresh read; after that the posts are appended on their own.
+    
+    :param business_id: Business that published the posts
+    :type business_id: str
+    :param published: (post_record, schedule_name) pairs for the business
+    :type published: list[tuple[dict, str | None]]
+    :param businesses: Business records prefetched for the batch
+    :type businesses: dict[str, dict | None] | None
+    :return: Indexes removed from upcomingPosts
+    :rtype: list[int]
+    """
+    update_expression = "SET publishedPosts = list_append(if_not_exists(publishedPosts, :empty), :posts)"
+    values = {":empty": [], ":posts": [post_record for post_record, _ in published]}
+    schedule_names = {schedule_name for _, schedule_name in published if schedule_name}
+    
+    if schedule_names:
+        business_data = businesses.get(business_id) if businesses else None
+        for attempt in range(2):
+            if business_data is None or attempt:
+                # Re-reads after a conflict must see the write that moved the list
+                response = table.get_item(
+                    Key={"businessID": business_id},
+                    ProjectionExpression="upcomingPosts",
+                    ConsistentRead=attempt > 0,
+                )
+                business_data = response.get("Item", {})
+            
+            # First upcomingPosts entry for each published schedule
+            indexes_by_name = {}
+            for i, p in enumerate(business_data.get("upcomingPosts", [])):
+                name = p.get("scheduleName")
+                if name in schedule_names and name not in indexes_by_name:
+                    indexes_by_name[name] = i
+                    if len(indexes_by_name) == len(schedule_names):
+                        break
+            if not indexes_by_name:
+                break
+            
+            indexes = sorted(indexes_by_name.values())
+            try:
+                table.update_item(
+                    Key={"businessID": business_id},
+                    UpdateExpression=f"{update_expression} REMOVE " + ", ".join(f"upcomingPosts[{i}]" for i in indexes),
+                    ConditionExpression=" AND ".join(
+                        f"upcomingPosts[{i}].scheduleName = :schedule{i}" for i in indexes
+                    ),
+                    ExpressionAttributeValues={
+                        **values,
+                        **{f":schedule{i}": name for name, i in indexes_by_name.items()},
+                    },
+                    ReturnValues="NONE",
+                )
+                return indexes
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise
+                logger.info("[POST_IG] upcomingPosts for %s changed since read", business_id)
+    
+    table.update_item(
+        Key={"businessID": business_id},
+        UpdateExpression=update_expression,
+        ConditionExpression="attribute_exists(businessID)",
+        ExpressionAttributeValues=values,
+        ReturnValues="NONE",
+    )
+    return []
+
+async def save_published_posts(business_id: str, published: list[tuple[dict, str | None]], businesses: dict[str, dict | None] | None = None) -> None:
+    """Persist published posts for a business without failing the batch.
+    
+    :param business_id: Business that published the posts
+    :type business_id: str
+    :param published: (post_record, schedule_name) pairs for the business
+    :type published: list[tuple[dict, str | None]]
+    :param businesses: Business records prefetched for the batch
+    :type businesses: dict[str, dict | None] | None
+    """
+    try:
+        removed = await asyncio.to_thread(record_published_posts, business_id, published, businesses)
+        logger.info("[POST_IG] publishedPosts updated for business %s with %d post(s)", business_id, len(published))
+        if removed:
+            logger.info("[POST_IG] Removed upcomingPosts%s for business %s", removed, business_id)
+    except Exception as update_exc:
+        logger.exception("[POST_IG] Failed to update publishedPosts for %s: %s", business_id, update_exc)
+
+async def create_instagram_media_container(image_url: str, caption: str, access_token: str, ig_user_id: str) -> tuple[str | None, bool]:
     """Create a media container on Instagram.
     
     :param image_url: URL of the image to post
@@ -75,60 +342,74 @@ def create_instagram_media_container(image_url: str, caption: str, access_token:
     :type access_token: str
     :param ig_user_id: Instagram user ID
     :type ig_user_id: str
-    :return: Container ID if successful, None otherwise
-    :rtype: str | None
+    :return: Tuple of (container_id, retryable); container_id is None on
+        failure, and retryable is False when Instagram rejected the request
+    :rtype: tuple[str | None, bool]
     """
     try:
-        url = f"{INSTAGRAM_API_BASE}/{ig_user_id}/media"
+        url = MEDIA_URL.format(ig_user_id)
         params = {
             'image_url': image_url,
             'caption': caption,
             'access_token': access_token
         }
         
-        response = requests.post(url, params=params)
-        logger.info("[POST_IG] create_container response %s - %s", response.status_code, response.text)
+        session = await get_http_session()
+        async with session.post(url, params=params, timeout=CREATE_TIMEOUT) as response:
+            body = await response.text()
+        logger.info("[POST_IG] create_container response %s - %s", response.status, body)
         
-        if response.status_code == 200:
-            result = response.json()
+        if response.status == 200:
+            result = orjson.loads(body)
             container_id = result.get('id')
             logger.info("[POST_IG] Created media container %s", container_id)
-            return container_id
+            return container_id, False
         else:
-            logger.error("[POST_IG] Failed to create media container: %s", response.text)
-            return None
+            logger.error("[POST_IG] Failed to create media container: %s", body)
+            return None, response.status in RETRY_STATUSES
             
     except Exception as e:
         logger.exception("[POST_IG] Exception during media container creation: %s", e)
-        return None
+        return None, True
 
-def poll_container_status(container_id: str, access_token: str, max_attempts: int = 10) -> str:
+async def poll_container_status(container_id: str, access_token: str, max_attempts: int = len(POLL_DELAYS), deadline: float | None = None) -> str:
     """Poll the status of a media container until completion.
     
+    Checks follow ``POLL_DELAYS`` so a container that finishes quickly is
+    picked up within about a second. Polling stops with ``TIMEOUT`` once
+    ``PUBLISH_BUDGET`` is all that is left before ``deadline``.
+    
     :param container_id: The container ID to check
     :type container_id: str
     :param access_token: Instagram access token
     :type access_token: str
     :param max_attempts: Maximum number of polling attempts
     :type max_attempts: int
-    :return: Final status of the container
+    :param deadline: ``time.monotonic()`` deadline for the record
+    :type deadline: float | None
+    :return: Final status of the container, or TIMEOUT / REQUEST_FAILED
     :rtype: str
     """
     try:
-        url = f"{INSTAGRAM_API_BASE}/{container_id}"
+        url = NODE_URL.format(container_id)
         params = {
             'fields': 'status_code',
             'access_token': access_token
         }
         
-        # Initial delay
-        time.sleep(3)
-        
-        for attempt in range(max_attempts):
-            response = requests.get(url, params=params)
+        for delay in POLL_DELAYS[:max_attempts]:
+            if time_left(deadline) - delay <= PUBLISH_BUDGET:
+                break
+            await asyncio.sleep(delay)
+            try:
+                status_code, body = await asyncio.wait_for(
+                    graph_get(url, params), time_left(deadline) - PUBLISH_BUDGET
+                )
+            except asyncio.TimeoutError:
+                break
             
-            if response.status_code == 200:
-                result = response.json()
+            if status_code == 200:
+                result = orjson.loads(body)
                 status = result.get('status_code', 'UNKNOWN')
                 
                 logger.info("[POST_IG] Container %s status %s", container_id, status)
@@ -137,60 +418,63 @@ def poll_container_status(container_id: str, access_token: str, max_attempts: in
                     logger.info("[POST_IG] Container %s ready", container_id)
                     return status
                 elif status == 'IN_PROGRESS':
-                    # Exponential backoff
-                    delay = 3 * (2 ** attempt)
-                    logger.info("[POST_IG] Container %s processing, wait %s s", container_id, delay)
-                    time.sleep(delay)
+                    logger.info("[POST_IG] Container %s processing", container_id)
                 else:
                     logger.error("[POST_IG] Container %s unexpected status %s", container_id, status)
                     return status
             else:
-                logger.error("[POST_IG] Failed to check status: %s", response.text)
-                return 'ERROR'
+                logger.error("[POST_IG] Failed to check status: %s", body)
+                return 'REQUEST_FAILED'
         
         logger.error("[POST_IG] Container %s polling timed out", container_id)
         return 'TIMEOUT'
         
     except Exception as e:
         logger.exception("[POST_IG] Exception during polling: %s", e)
-        return 'ERROR'
+        return 'REQUEST_FAILED'
 
-def publish_instagram_media(container_id: str, access_token: str, ig_user_id: str) -> str | None:
+async def publish_instagram_media(container_id: str, access_token: str, ig_user_id: str) -> tuple[str, str | None] | tuple[None, None]:
     """Publish a media container to Instagram.
     
+    The permalink is requested in the same call; it is None when the
+    response does not include it.
+    
     :param container_id: The container ID to publish
     :type container_id: str
     :param access_token: Instagram access token
     :type access_token: str
     :param ig_user_id: Instagram user ID
     :type ig_user_id: str
-    :return: Published media ID if successful, None otherwise
-    :rtype: str | None
+    :return: Tuple of (media_id, permalink) if successful, (None, None) otherwise
+    :rtype: tuple[str, str | None] | tuple[None, None]
     """
     try:
-        url = f"{INSTAGRAM_API_BASE}/{ig_user_id}/media_publish"
+        url = PUBLISH_URL.format(ig_user_id)
         params = {
             'creation_id': container_id,
+            'fields': 'id,permalink',
             'access_token': access_token
         }
         
-        response = requests.post(url, params=params)
-        logger.info("[POST_IG] publish response %s - %s", response.status_code, response.text)
+        session = await get_http_session()
+        async with session.post(url, params=params, timeout=PUBLISH_TIMEOUT) as response:
+            body = await response.text()
+        logger.info("[POST_IG] publish response %s - %s", response.status, body)
         
-        if response.status_code == 200:
-            result = response.json()
+        if response.status == 200:
+            result = orjson.loads(body)
             media_id = result.get('id')
             logger.info("[POST_IG] Published media %s", media_id)
-            return media_id
+            return media_id, result.get('permalink')
         else:
-            logger.error("[POST_IG] Failed to publish media: %s", response.text)
-            return None
+            logger.error("[POST_IG] Failed to publish media: %s", body)
+            return None, None
             
     except Exception as e:
         logger.exception("[POST_IG] Exception during publish: %s", e)
-        return None
+        return None, None
 
-def get_instagram_permalink(media_id: str, access_token: str) -> str | None:
+async def get_instagram_permalink(media_id: str, access_token: str) -> str | None:
     """Get the Instagram permalink for a published media.
     
     :param media_id: The published media ID
@@ -201,32 +485,38 @@ def get_instagram_permalink(media_id: str, access_token: str) -> str | None:
     :rtype: str | None
     """
     try:
-        url = f"{INSTAGRAM_API_BASE}/{media_id}"
+        url = NODE_URL.format(media_id)
         params = {
             'fields': 'permalink',
             'access_token': access_token
         }
         
-        response = requests.get(url, params=params)
-        logger.info("[POST_IG] permalink response %s - %s", response.status_code, response.text)
+        status_code, body = await graph_get(url, params)
+        logger.info("[POST_IG] permalink response %s - %s", status_code, body)
         
-        if response.status_code == 200:
-            result = response.json()
+        if status_code == 200:
+            result = orjson.loads(body)
             permalink = result.get('permalink')
             logger.info("[POST_IG] Retrieved permalink %s", permalink)
             return permalink
         else:
-            logger.error("[POST_IG] Failed to retrieve permalink: %s", response.text)
+            logger.error("[POST_IG] Failed to retrieve permalink: %s", body)
             return None
             
     except Exception as e:
         logger.exception("[POST_IG] Exception during permalink retrieval: %s", e)
         return None
 
-def post_to_instagram(image_url: str, caption: str, business_id: str, trigger_category: str | None = None, seed: int | None = None) -> bool:
+async def post_to_instagram(image_url: str, caption: str, business_id: str, trigger_category: str | None = None, seed: int | None = None, schedule_name: str | None = None, businesses: dict[str, dict | None] | None = None, published: dict[str, list] | None = None, deadline: float | None = None) -> tuple[bool, bool]:
     """
     Complete workflow to post content to Instagram.
     
+    Only failures before the publish call are worth redelivering, and not
+    those caused by the business's Instagram connection or by Instagram
+    rejecting the media. A failed publish may still have gone out, so it is
+    never retried. No container is created unless there is time to create
+    and publish it before ``deadline``.
+    
     :param image_url: URL of the image to post
     :type image_url: str
     :param caption: Caption for the post
@@ -237,166 +527,269 @@ def post_to_instagram(image_url: str, caption: str, business_id: str, trigger_ca
     :type trigger_category: str | None
     :param seed: Random seed used during generation
     :type seed: int | None
-    :return: True if successful, False otherwise
-    :rtype: bool
+    :param schedule_name: Schedule whose upcomingPosts entry should be removed
+    :type schedule_name: str | None
+    :param businesses: Business records prefetched for the batch
+    :type businesses: dict[str, dict | None] | None
+    :param published: Batch collector of (post_record, schedule_name) pairs
+        by business; when omitted the post is recorded immediately
+    :type published: dict[str, list] | None
+    :param deadline: ``time.monotonic()`` deadline for the record
+    :type deadline: float | None
+    :return: Tuple of (success, retryable)
+    :rtype: tuple[bool, bool]
     """
     logger.info("[POST_IG] Start post workflow for business %s", business_id)
     
     # Get Instagram credentials
-    access_token, ig_user_id = get_business_instagram_token(business_id)
+    # boto3 calls block, so they run in the default executor to keep the
+    # event loop free for other records' Instagram requests
+    access_token, ig_user_id = await asyncio.to_thread(get_business_instagram_token, business_id, businesses)
     if not access_token or not ig_user_id:
-        return False
+        return False, False
+    
+    if time_left(deadline) < CREATE_BUDGET:
+        logger.warning("[POST_IG] Not enough time left to post for business %s", business_id)
+        return False, True
     
     # Create media container
-    container_id = create_instagram_media_container(image_url, caption, access_token, ig_user_id)
+    container_id, retryable = await create_instagram_media_container(image_url, caption, access_token, ig_user_id)
     if not container_id:
-        return False
+        # The token may have been revoked; read it afresh on the next attempt
+        CREDENTIALS_CACHE.pop(business_id, None)
+        return False, retryable
     
     # Poll until container is ready
-    status = poll_container_status(container_id, access_token)
+    status = await poll_container_status(container_id, access_token, deadline=deadline)
     if status != 'FINISHED':
-        logger.error(f"ERROR: Container not ready for publishing, final status: {status}")
-        return False
+        logger.error("[POST_IG] Container not ready for publishing, final status: %s", status)
+        return False, status in RETRYABLE_POLL_STATUSES
     
     # Publish the media
-    media_id = publish_instagram_media(container_id, access_token, ig_user_id)
+    media_id, permalink = await publish_instagram_media(container_id, access_token, ig_user_id)
     if not media_id:
-        return False
+        # A timeout or 5xx can hide a successful publish; redelivering would
+        # post the same content twice
+        return False, False
 
-    # Get Instagram permalink
-    permalink = get_instagram_permalink(media_id, access_token)
+    # Fetch the permalink separately only if publish did not return it and
+    # there is time; the post is recorded either way
+    if not permalink and time_left(deadline) > 0:
+        try:
+            permalink = await asyncio.wait_for(get_instagram_permalink(media_id, access_token), time_left(deadline))
+        except asyncio.TimeoutError:
+            logger.warning("[POST_IG] Skipped permalink lookup for media %s, out of time", media_id)
 
     # --------------------------------------------------------------------
     # Record successful publication in Businesses.publishedPosts
     # --------------------------------------------------------------------
+    current_ts = datetime.utcnow().isoformat() + "Z"
+    post_record = {
+        "postID": media_id,
+        "s3Url": image_url,
+        "caption": caption,
+        "timestamp": current_ts,
+        "status": "published",
+    }
+    
+    if permalink:
+        post_record["permalink"] = permalink
+    
+    if trigger_category:
+        post_record["triggerCategory"] = trigger_category
+    
+    # Persist random seed if provided (helps trace Titan generation)
+    if seed is not None:
+        post_record["seed"] = seed
+    
+    if published is not None:
+        published[business_id].append((post_record, schedule_name))
+    else:
+        await save_published_posts(business_id, [(post_record, schedule_name)], businesses)
+
+    logger.info("[POST_IG] Post completed for business %s mediaID %s", business_id, media_id)
+    return True, False
+
+def parse_record(record: dict) -> tuple[dict | None, str | None]:
+    """Parse and validate the body of an SQS record.
+    
+    :param record: SQS message record
+    :type record: dict
+    :return: Tuple of (message, None) for a valid record, (None, error_message) otherwise
+    :rtype: tuple[dict | None, str | None]
+    """
     try:
-        current_ts = datetime.utcnow().isoformat() + "Z"
-        post_record = {
-            "postID": media_id,
-            "s3Url": image_url,
-            "caption": caption,
-            "timestamp": current_ts,
-            "status": "published",
-        }
+        message_body = orjson.loads(record['body'])
+    except (KeyError, TypeError, orjson.JSONDecodeError) as e:
+        error_msg = f"Exception processing message: {str(e)}"
+        logger.error("[POST_IG] %s", error_msg)
+        return None, error_msg
+    
+    if (
+        not isinstance(message_body, dict)
+        or not message_body.get('caption')
+        or not isinstance(message_body.get('image_url'), str) or not message_body['image_url']
+        or not isinstance(message_body.get('businessID'), str) or not message_body['businessID']
+    ):
+        error_msg = "Message is missing required fields (caption, image_url, businessID)"
+        logger.error("[POST_IG] %s", error_msg)
+        return None, error_msg
+    
+    return message_body, None
+
+async def process_record(message_body: dict, businesses: dict[str, dict | None] | None = None, published: dict[str, list] | None = None, deadline: float | None = None) -> tuple[bool, str | None, bool]:
+    """Post the content of a validated SQS message to Instagram.
+    
+    :param message_body: Message accepted by ``parse_record``
+    :type message_body: dict
+    :param businesses: Business records prefetched for the batch
+    :type businesses: dict[str, dict | None] | None
+    :param published: Batch collector of published posts by business
+    :type published: dict[str, list] | None
+    :param deadline: ``time.monotonic()`` deadline for the record
+    :type deadline: float | None
+    :return: Tuple of (success, error_message, retryable)
+    :rtype: tuple[bool, str | None, bool]
+    """
+    try:
+        if logger.isEnabledFor(logging.INFO):
+            logger.info("[POST_IG] Processing message %s", message_body)
         
-        if permalink:
-            post_record["permalink"] = permalink
+        caption = message_body['caption']
+        image_url = message_body['image_url']
+        business_id = message_body['businessID']
+        schedule_name = message_body.get('scheduleName')
+        trigger_category = message_body.get('triggerCategory')
+        seed = message_body.get('seed')
         
-        if trigger_category:
-            post_record["triggerCategory"] = trigger_category
+        # Attempt to post to Instagram
+        success, retryable = await post_to_instagram(image_url, caption, business_id, trigger_category, seed, schedule_name, businesses, published, deadline)
         
-        # Persist random seed if provided (helps trace Titan generation)
-        if seed is not None:
-            post_record["seed"] = seed
+        if not success:
+            return False, f"Failed to post to Instagram for business {business_id}", retryable
         
-        table.update_item(
-            Key={"businessID": business_id},
-            UpdateExpression=(
-                "SET publishedPosts = list_append(if_not_exists(publishedPosts, :empty), :post)"
-            ),
-            ExpressionAttributeValues={
-                ":empty": [],
-                ":post": [post_record],
-            },
-        )
-        logger.info(
-            f"INFO: publishedPosts updated for business {business_id} with postID {media_id}"
-        )
-    except Exception as update_exc:
-        logger.exception(
-            f"ERROR: Failed to update publishedPosts for {business_id}: {update_exc}"
-        )
+        logger.info("[POST_IG] Posted to Instagram for business %s", business_id)
+        return True, None, False
+            
+    except Exception as e:
+        error_msg = f"Exception processing message: {str(e)}"
+        logger.exception("[POST_IG] %s", error_msg)
+        return False, error_msg, True
 
-    logger.info("[POST_IG] Post completed for business %s mediaID %s", business_id, media_id)
-    return True
+async def process_batch(records: list[dict], deadline: float | None = None) -> list[tuple[bool, str | None, bool]]:
+    """Process all SQS records concurrently on the shared event loop.
+    
+    Every record is validated before any network work starts. Malformed
+    records fail without being retried, and a repeated (businessID,
+    image_url) pair within the batch is acknowledged without posting again.
+    
+    :param records: SQS message records
+    :type records: list[dict]
+    :param deadline: ``time.monotonic()`` deadline for the records' Instagram work
+    :type deadline: float | None
+    :return: One ``(success, error_message, retryable)`` outcome per record, in record order
+    :rtype: list[tuple[bool, str | None, bool]]
+    """
+    outcomes: list[tuple[bool, str | None, bool] | None] = [None] * len(records)
+    pending: list[tuple[int, dict]] = []
+    seen = set()
+    for position, record in enumerate(records):
+        message_body, error_msg = parse_record(record)
+        if message_body is None:
+            outcomes[position] = (False, error_msg, False)
+            continue
+        key = (message_body['businessID'], message_body['image_url'])
+        if key in seen:
+            logger.warning("[POST_IG] Skipping duplicate post of %s for business %s", key[1], key[0])
+            outcomes[position] = (True, None, False)
+            continue
+        seen.add(key)
+        pending.append((position, message_body))
+    
+    businesses = None
+    now = time.time()
+    business_ids = set()
+    for _, message_body in pending:
+        cached = CREDENTIALS_CACHE.get(message_body['businessID'])
+        if not cached or cached[2] <= now:
+            business_ids.add(message_body['businessID'])
+    if business_ids:
+        try:
+            businesses = await asyncio.to_thread(fetch_businesses, business_ids)
+        except Exception as e:
+            logger.warning("[POST_IG] Batch business read failed, falling back to per-record reads: %s", e)
+    
+    # One publishedPosts write per business, started as soon as that
+    # business's last record finishes so it overlaps records still polling
+    published = defaultdict(list)
+    remaining = Counter(message_body['businessID'] for _, message_body in pending)
+    save_tasks = []
+    
+    async def run(message_body: dict) -> tuple[bool, str | None, bool]:
+        outcome = await process_record(message_body, businesses, published, deadline)
+        business_id = message_body['businessID']
+        remaining[business_id] -= 1
+        if not remaining[business_id] and business_id in published:
+            save_tasks.append(asyncio.create_task(
+                save_published_posts(business_id, published.pop(business_id), businesses)
+            ))
+        return outcome
+    
+    # Every record starts at once so all containers are created up front and
+    # their processing overlaps; socket use is bounded by the HTTP connector
+    results = await asyncio.gather(*(run(message_body) for _, message_body in pending))
+    for (position, _), outcome in zip(pending, results):
+        outcomes[position] = outcome
+    
+    await asyncio.gather(*save_tasks)
+    return outcomes
 
 def lambda_handler(event, context):
     """
     AWS Lambda handler for processing SQS messages and posting to Instagram.
     
+    Records in the batch are processed concurrently and must finish
+    ``SAVE_MARGIN`` seconds before the invocation would time out. Records
+    that failed for a retryable reason are reported through
+    ``batchItemFailures`` so SQS only redelivers those messages.
+    
     :param event: SQS event containing message records
     :type event: dict
     :param context: Lambda runtime context
     :type context: LambdaContext
-    :return: HTTP response with processing status
+    :return: HTTP response with processing status and partial batch failures
     :rtype: dict
     """
-    processed = 0
+    records = event['Records']
     successful = 0
     failed = 0
     errors = []
+    batch_item_failures = []
     
-    for record in event['Records']:
-        processed += 1
-        
-        try:
-            message_body = json.loads(record['body'])
-            logger.info("[POST_IG] Processing message %s", json.dumps(message_body))
-            
-            caption = message_body.get('caption')
-            image_url = message_body.get('image_url')
-            business_id = message_body.get('businessID')
-            schedule_name = message_body.get('scheduleName')
-            trigger_category = message_body.get('triggerCategory')
-            seed = message_body.get('seed')
-        
-            if not caption or not image_url or not business_id:
-                error_msg = "Message is missing required fields (caption, image_url, businessID)"
-                logger.error(f"ERROR: {error_msg}")
-                errors.append(error_msg)
-                failed += 1
-                continue
-            
-            # Attempt to post to Instagram
-            success = post_to_instagram(image_url, caption, business_id, trigger_category, seed)
-            
-            if success:
-                successful += 1
-                logger.info(f"SUCCESS: Posted to Instagram for business {business_id}")
-
-                # Cleanup upcomingPosts entry if schedule_name provided
-                if schedule_name:
-                    try:
-                        item = table.get_item(Key={"businessID": business_id}, ProjectionExpression="upcomingPosts")
-                        posts = item.get("Item", {}).get("upcomingPosts", [])
-                        idx_to_remove = next(
-                            (i for i, p in enumerate(posts) if p.get("scheduleName") == schedule_name),
-                            None,
-                        )
-                        if idx_to_remove is not None:
-                            table.update_item(
-                                Key={"businessID": business_id},
-                                UpdateExpression=f"REMOVE upcomingPosts[{idx_to_remove}]",
-                            )
-                            logger.info(
-                                f"INFO: Removed upcomingPosts[{idx_to_remove}] for business {business_id}"
-                            )
-                    except Exception as cleanup_exc:
-                        logger.error(
-                            f"ERROR: Failed to cleanup upcomingPosts for {business_id}: {cleanup_exc}"
-                        )
-            else:
-                failed += 1
-                error_msg = f"Failed to post to Instagram for business {business_id}"
-                errors.append(error_msg)
-                
-        except Exception as e:
-            failed += 1
-            error_msg = f"Exception processing message: {str(e)}"
-            logger.exception(f"ERROR: {error_msg}")
-            errors.append(error_msg)
+    deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - SAVE_MARGIN
+    outcomes = get_event_loop().run_until_complete(process_batch(records, deadline))
+    
+    for record, (success, error_msg, retryable) in zip(records, outcomes):
+        if success:
+            successful += 1
+            continue
+        failed += 1
+        errors.append(error_msg)
+        if retryable:
+            batch_item_failures.append({'itemIdentifier': record['messageId']})
 
     # Return processing summary
     result = {
-        'processed': processed,
+        'processed': len(records),
         'successful': successful,
         'failed': failed,
         'errors': errors
     }
     
-    logger.info("[POST_IG] Processing complete %s", json.dumps(result))
+    logger.info("[POST_IG] Processing complete %s", result)
     
     return {
         'statusCode': 200,
-        'body': json.dumps(result)
-    } 
\ No newline at end of file
+        'body': orjson.dumps(result).decode(),
+        'batchItemFailures': batch_item_failures
+    }
@@ -1,14 +1,164 @@
 import json
-import boto3
 import logging
-from botocore.exceptions import ClientError
+import time
+
+# Fastest available JSON encoder, chosen once at import:
+# orjson, then rapidjson, then ujson, then stdlib json
+try:
+    import orjson
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode()
+except ImportError:
+    try:
+        from rapidjson import dumps
+    except ImportError:
+        try:
+            from ujson import dumps
+        except ImportError:
+            dumps = json.dumps
 
 # Set up logging
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# Initialize DynamoDB client
-dynamodb = boto3.resource('dynamodb')
+# The level is fixed at import, so the check is resolved once per container
+LOG_INFO_ENABLED = logger.isEnabledFor(logging.INFO)
+
+# Low-level DynamoDB client, created on first use so invocations that never
+# save skip the boto3 import; the client avoids the resource layer entirely
+_dynamodb_client = None
+
+def get_dynamodb_client():
+    """
+    Return the DynamoDB client, importing boto3 on first call
+    """
+    global _dynamodb_client
+    if _dynamodb_client is None:
+        import boto3
+        from botocore.config import Config
+        _dynamodb_client = boto3.client('dynamodb', config=Config(
+            connect_timeout=1,
+            read_timeout=3,
+            retries={'mode': 'adaptive', 'max_attempts': 2},
+            max_pool_connections=10
+        ))
+    return _dynamodb_client
+
+# Stored fields of each marketing_triggers section and their defaults
+TRIGGER_SECTION_DEFAULTS = {
+    'weather_triggers': {'enabled': False, 'conditions': [], 'location': None},
+    'holiday_triggers': {'enabled': False, 'holidays': [], 'advance_days': 3},
+    'schedule_triggers': {'enabled': False, 'frequency': 'weekly', 'days_of_week': [], 'time_of_day': '09:00'},
+    'content_preferences': {'tone': 'professional', 'style': 'promotional', 'include_hashtags': True, 'max_hashtags': 10}
+}
+
+# Flattened once so each request iterates plain (key, default) tuples
+TRIGGER_SECTIONS = tuple(
+    (name, tuple(defaults.items())) for name, defaults in TRIGGER_SECTION_DEFAULTS.items()
+)
+
+# Sections that count towards triggers_count when enabled
+TRIGGER_TYPES = ('weather_triggers', 'holiday_triggers', 'schedule_triggers')
+
+# Fixed parts of the success body; only trigger_data, user_id and
+# triggers_count are serialized per request
+SUCCESS_MESSAGE = 'Marketing triggers saved successfully'
+SAVE_OPERATION = 'triggers_saved'
+SAVE_STATUS = 'success'
+SUCCESS_BODY_PREFIX = '{"message":' + dumps(SUCCESS_MESSAGE) + ',"trigger_data":'
+SAVE_RESPONSE_PREFIX = ',"save_response":{"operation":' + dumps(SAVE_OPERATION) + ',"user_id":'
+SAVE_RESPONSE_INFIX = ',"status":' + dumps(SAVE_STATUS) + ',"triggers_count":'
+SUCCESS_BODY_SUFFIX = '}}'
+
+# Error label of every failed save; the message carries the reason
+SAVE_ERROR = 'Failed to save marketing triggers'
+
+# Shared default for missing objects in the event; only ever read, never mutated
+EMPTY = {}
+
+def build_section(section, fields):
+    """
+    Pick the known fields of one marketing_triggers section, filling defaults;
+    list defaults are copied so no request shares the module-level lists
+    """
+    return {
+        key: section[key] if key in section else (list(default) if isinstance(default, list) else default)
+        for key, default in fields
+    }
+
+def error_response(message):
+    """
+    Build the 500 response returned for any request that could not be saved
+    """
+    return {
+        'statusCode': 500,
+        'body': dumps({
+            'error': SAVE_ERROR,
+            'message': message
+        })
+    }
+
+def save_marketing_triggers(event, context):
+    """
+    Validate the event and save its marketing triggers, returning the response
+    """
+    # Reject requests without a user before any other work
+    user_id = event.get('user_id')
+    if not user_id:
+        return error_response("User ID is required")
+    
+    # Log the incoming event
+    if LOG_INFO_ENABLED:
+        logger.info("Received event: %s", dumps(event))
+    
+    # Extract trigger data from event
+    marketing_triggers = event.get('marketing_triggers', EMPTY)
+    
+    if not isinstance(user_id, str):
+        return error_response("User ID must be a string")
+    if not isinstance(marketing_triggers, dict):
+        return error_response("marketing_triggers must be an object")
+    
+    # Prepare trigger data for storage
+    trigger_data = {'user_id': user_id}
+    for name, fields in TRIGGER_SECTIONS:
+        section = marketing_triggers.get(name, EMPTY)
+        if not isinstance(section, dict):
+            return error_response(f"{name} must be an object")
+        trigger_data[name] = build_section(section, fields)
+    now_ms = time.time_ns() // 1_000_000
+    trigger_data['created_at'] = now_ms
+    trigger_data['last_updated'] = now_ms
+    trigger_data['request_id'] = context.aws_request_id
+    
+    # TODO: Save to DynamoDB
+    # In a real implementation, you would save this to a DynamoDB table
+    # client = get_dynamodb_client()
+    # from boto3.dynamodb.types import TypeSerializer
+    # from botocore.exceptions import ClientError
+    # serializer = TypeSerializer()
+    # try:
+    #     response = client.put_item(
+    #         TableName='MarketingTriggers',
+    #         Item={k: serializer.serialize(v) for k, v in trigger_data.items()}
+    #     )
+    # except ClientError as e:
+    #     logger.exception("Error saving marketing triggers")
+    #     return error_response(str(e))
+    
+    # Simulate successful save
+    triggers_count = sum(1 for name in TRIGGER_TYPES if trigger_data[name]['enabled'])
+    
+    return {
+        'statusCode': 200,
+        'body': (
+            SUCCESS_BODY_PREFIX + dumps(trigger_data)
+            + SAVE_RESPONSE_PREFIX + dumps(user_id)
+            + SAVE_RESPONSE_INFIX + str(triggers_count)
+            + SUCCESS_BODY_SUFFIX
+        )
+    }
 
 def lambda_handler(event, context):
     """
@@ -16,77 +166,7 @@ def lambda_handler(event, context):
     Saves user's marketing plan choices and trigger preferences
     """
     try:
-        # Log the incoming event
-        logger.info(f"Received event: {json.dumps(event)}")
-        
-        # Extract trigger data from event
-        user_id = event.get('user_id')
-        marketing_triggers = event.get('marketing_triggers', {})
-        
-        if not user_id:
-            raise ValueError("User ID is required")
-        
-        # Prepare trigger data for storage
-        trigger_data = {
-            'user_id': user_id,
-            'weather_triggers': {
-                'enabled': marketing_triggers.get('weather_triggers', {}).get('enabled', False),
-                'conditions': marketing_triggers.get('weather_triggers', {}).get('conditions', []),
-                'location': marketing_triggers.get('weather_triggers', {}).get('location')
-            },
-            'holiday_triggers': {
-                'enabled': marketing_triggers.get('holiday_triggers', {}).get('enabled', False),
-                'holidays': marketing_triggers.get('holiday_triggers', {}).get('holidays', []),
-                'advance_days': marketing_triggers.get('holiday_triggers', {}).get('advance_days', 3)
-            },
-            'schedule_triggers': {
-                'enabled': marketing_triggers.get('schedule_triggers', {}).get('enabled', False),
-                'frequency': marketing_triggers.get('schedule_triggers', {}).get('frequency', 'weekly'),
-                'days_of_week': marketing_triggers.get('schedule_triggers', {}).get('days_of_week', []),
-                'time_of_day': marketing_triggers.get('schedule_triggers', {}).get('time_of_day', '09:00')
-            },
-            'content_preferences': {
-                'tone': marketing_triggers.get('content_preferences', {}).get('tone', 'professional'),
-                'style': marketing_triggers.get('content_preferences', {}).get('style', 'promotional'),
-                'include_hashtags': marketing_triggers.get('content_preferences', {}).get('include_hashtags', True),
-                'max_hashtags': marketing_triggers.get('content_preferences', {}).get('max_hashtags', 10)
-            },
-            'created_at': context.aws_request_id,
-            'last_updated': context.aws_request_id
-        }
-        
-        # TODO: Save to DynamoDB
-        # In a real implementation, you would save this to a DynamoDB table
-        # table = dynamodb.Table('MarketingTriggers')
-        # response = table.put_item(Item=trigger_data)
-        
-        # Simulate successful save
-        save_response = {
-            "operation": "triggers_saved",
-            "user_id": user_id,
-            "status": "success",
-            "triggers_count": len([t for t in [
-                trigger_data['weather_triggers']['enabled'],
-                trigger_data['holiday_triggers']['enabled'],
-                trigger_data['schedule_triggers']['enabled']
-            ] if t])
-        }
-        
-        return {
-            'statusCode': 200,
-            'body': json.dumps({
-                'message': 'Marketing triggers saved successfully',
-                'trigger_data': trigger_data,
-                'save_response': save_response
-            })
-        }
-        
+        return save_marketing_triggers(event, context)
     except Exception as e:
-        logger.error(f"Error saving marketing triggers: {str(e)}")
-        return {
-            'statusCode': 500,
-            'body': json.dumps({
-                'error': 'Failed to save marketing triggers',
-                'message': str(e)
-            })
-        } 
\ No newline at end of file
+        logger.exception("Error saving marketing triggers")
+        return error_response(str(e))